@@ -4,11 +4,11 @@ from typing import List, Dict, Any, Optional
 from dataclasses import dataclass
 from enum import Enum
 import asyncio
-from core.config import get_settings
+import threading
+from core.config import settings
 from utils import *
 from openai import OpenAI
 
-settings = get_settings()
 
 class ConversationState(Enum):
     INITIAL = "initial"
@@ -32,13 +32,24 @@ class SymptomData:
     duration_info: Dict[str, str]
     additional_context: Dict[str, Any]
 
+# Shared across calls so connections are pooled; kept local because this module runs with
+# agents/Drug_Analysis on sys.path, where `utils` is the sibling utils.py and not the utils package
+_client = None
+_client_lock = threading.Lock()
+
+def _get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI(
+                    api_key=settings.OPENAI_API_KEY,
+                    base_url=settings.OPENAI_API_BASE,
+                )
+    return _client
+
 def get_sambanova_response(messages, model="Meta-Llama-3.3-70B-Instruct", system_prompt=None):
     """Helper function to get response from SambaNova API"""
-    client = OpenAI(
-        api_key=settings.OPENAI_API_KEY,
-        base_url=settings.OPENAI_API_BASE,
-    )
-    
     # Format messages properly for OpenAI-style API
     formatted_messages = []
     
@@ -53,7 +64,7 @@ def get_sambanova_response(messages, model="Meta-Llama-3.3-70B-Instruct", system
         })
     
     try:
-        response = client.chat.completions.create(
+        response = _get_client().chat.completions.create(
             model=model,
             messages=formatted_messages,
             max_tokens=1000,
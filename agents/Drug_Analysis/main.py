@@ -6,6 +6,7 @@ from enum import Enum
 import asyncio
 from agents.Drug_Analysis.utils import MedicalRAGIndexer
 from agents.Utils.common_methods import get_sambanova_response
+from core.prompts import MEDIASSIST_PREAMBLE
 from openai import OpenAI
 from langchain_core.messages import HumanMessage
 
@@ -77,7 +78,7 @@ class MedicalChatbot:
     
     def _initialize_prompts(self) -> Dict[str, str]:
         """Initialize system prompts for different conversation stages"""
-        return {
+        prompts = {
             "symptom_extraction": """You are a medical assistant that extracts symptoms from patient descriptions.
 
 Your task: Extract all symptoms mentioned by the user and return them in a structured JSON format.
@@ -155,6 +156,8 @@ Always be:
 
 Keep responses helpful and focused."""
         }
+        # Every stage shares the same leading bytes so the provider can reuse the cached prefix
+        return {stage: MEDIASSIST_PREAMBLE + prompt for stage, prompt in prompts.items()}
     
     def process_user_message(self, user_input: str) -> str:
         """
@@ -2,7 +2,8 @@
 
 import json
 import re
-from ..Utils.common_methods import get_sambanova_response
+from ..Utils.common_methods import aget_sambanova_response
+from core.prompts import MEDIASSIST_PREAMBLE
 
 
 
@@ -11,7 +12,8 @@ class IntentIdentifier :
         self.chat_history = chat_history
 
     def get_intent_classifier_sysPrompt(self):
-        prompt = f"""# Intent Classification Agent System Prompt
+        # Chat history goes last so the shared preamble and the instructions form a stable cacheable prefix
+        prompt = MEDIASSIST_PREAMBLE + f"""# Intent Classification Agent System Prompt
     ```
     ## Role
     You are an intelligent intent classification agent specialized in healthcare-related conversations. Your primary responsibility is to analyze user input and classify it into the appropriate category while providing contextually relevant responses.
@@ -19,9 +21,6 @@ class IntentIdentifier :
     ## Task
     Taking the context of CHAT_HISTORY Classify user input into one of three predefined tags and generate an appropriate response for each classification.
 
-    ## CHAT_HISTORY
-    {self.chat_history}
-
     ## Input Types
     - **Text messages**: User-written descriptions of symptoms, diseases, medications, or general conversation
     - **Prescription uploads**: Images or documents containing medication lists
@@ -95,19 +94,22 @@ class IntentIdentifier :
     - Never provide specific medical diagnoses or treatment recommendations
     - Encourage users to consult healthcare professionals for serious concerns
     - Ensure JSON output is properly formatted and valid
-    - Keep responses concise but helpful (2-3 sentences maximum)```"""
+    - Keep responses concise but helpful (2-3 sentences maximum)```
+
+    ## CHAT_HISTORY
+    {self.chat_history}"""
         return prompt
 
     def append_message_to_list(self, messages, role, content):
         messages.append({"role":role, "content": content})
 
 
-    def get_intent_agent_response(self,query:str = ""):
+    async def get_intent_agent_response(self,query:str = ""):
         messages = []
         self.append_message_to_list(messages, "system", self.get_intent_classifier_sysPrompt())
         user_input = f"[USER] : {query}"
         self.append_message_to_list(messages, "user", user_input)
-        asst_response = get_sambanova_response(messages)
+        asst_response = await aget_sambanova_response(messages)
         self.append_message_to_list(messages, "assistant", asst_response)
         return messages, asst_response
     
@@ -1,45 +1,317 @@
+import atexit
 import json
-import pandas as pd
-from agents.Utils.common_methods import encode_image, get_sambanova_response
-from neo4j import GraphDatabase
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from agents.Medical_Analysis.drug_ner import extract_drug_names
+from agents.Utils.common_methods import get_image_data_uri, get_sambanova_response
 from itertools import combinations
-from core.config import get_settings
+from core.config import settings
+from core.prompts import MEDIASSIST_PREAMBLE
 from utils.logger import logger
 
-settings = get_settings()
+
+# The driver is thread-safe and owns the connection pool, so it is shared by every MedicalAgent
+_driver = None
+_driver_lock = threading.Lock()
+
+def _get_driver():
+    """Create the shared Neo4j driver on first use; neo4j is imported lazily to keep cold starts light."""
+    global _driver
+    if _driver is None:
+        with _driver_lock:
+            if _driver is None:
+                from neo4j import GraphDatabase
+
+                _driver = GraphDatabase.driver(
+                    settings.NEO4J_URI,
+                    auth=(settings.NEO4J_USERNAME, settings.NEO4J_PASSWORD),
+                    max_connection_pool_size=settings.NEO4J_MAX_POOL_SIZE,
+                    connection_acquisition_timeout=settings.NEO4J_ACQUISITION_TIMEOUT,
+                )
+    return _driver
+
+# Runs the independent graph reads of a request side by side, each on its own pooled session
+_read_executor = None
+
+def _get_read_executor() -> ThreadPoolExecutor:
+    """Create the shared graph-read thread pool on first use (again after `close_driver`)."""
+    global _read_executor
+    if _read_executor is None:
+        with _driver_lock:
+            if _read_executor is None:
+                _read_executor = ThreadPoolExecutor(max_workers=settings.NEO4J_READ_WORKERS, thread_name_prefix="neo4j-read")
+    return _read_executor
+
+# Cypher kept as constants so every call ships the same text and hits the same cached plan
+_CREATE_INDEX_CYPHER = (
+    "CREATE INDEX drug_name IF NOT EXISTS FOR (d:Drug) ON (d.name)",
+    "CREATE INDEX drug_db_id IF NOT EXISTS FOR (d:Drug) ON (d.drugbank_id)",
+)
+
+_GET_ALL_DRUG_NAMES_CYPHER = """
+MATCH (d:Drug)
+RETURN d.name AS name
+"""
+
+# Compares d.name directly so the lookup is an index seek on drug_name rather than a label scan
+_GET_EXISTING_DRUGS_CYPHER = """
+MATCH (d:Drug)
+WHERE d.name IN $names
+RETURN d.name AS name
+"""
+
+_GET_DRUG_INFO_CYPHER = """
+MATCH (d:Drug)
+WHERE d.name IN $drug_names
+RETURN {id: d.drugbank_id, name: d.name, description: d.description,
+    indication: d.indication, mechanism: d.mechanism_of_action, toxicity: d.toxicity, food_interactions: d.food_interactions} AS drug
+"""
+
+_GET_INTERACTIONS_CYPHER = """
+MATCH (a:Drug {name: $drug1})-[r:INTERACTS_WITH]-(b:Drug {name: $drug2})
+RETURN {drug1: a.name, drug2: b.name, description: r.description} AS interaction
+"""
+
+DRUG_INFO_SYSTEM_PROMPT = MEDIASSIST_PREAMBLE + """You are a helpful clinical assistant.
+
+# Clinical Drug Analysis Assistant
+
+## Instructions
+You are a clinical assistant tasked with analyzing drug information. The user will provide a Drug Information Database and a Drug-Drug Interaction Analysis. Please follow these steps:
+
+1. **Summarize each drug** - Provide a clear, concise summary of each medication
+2. **Analyze combination risks** - List and explain the risks of combining any of these drugs
+3. **Base responses on provided data only** - Do not generate information that cannot be verified from the provided data
+
+## Output Requirements
+
+Please structure your response as follows:
+
+### Drug Summaries
+Provide a concise summary for each medication provided.
+
+### Combination Risk Assessment
+Analyze and explain any risks associated with combining these medications, based solely on the interaction data provided.
+
+### Clinical Recommendations
+Offer appropriate guidance for patients or clinicians based on the available information. Include food-interaction recommendations as well if appropriate
+
+**Note:** All information should be clearly attributed to the provided data sources. Do not include speculative or unverified information."""
+
+_indexes_ready = False
+_indexes_lock = threading.Lock()
+
+def _ensure_indexes():
+    """Create the Drug lookup indexes once per process; the statements are idempotent."""
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    with _indexes_lock:
+        if _indexes_ready:
+            return
+        try:
+            with _get_driver().session(database=settings.NEO4J_DATABASE) as session:
+                for statement in _CREATE_INDEX_CYPHER:
+                    session.run(statement).consume()
+            logger.info("Neo4j Drug indexes ensured.")
+        except Exception as e:
+            # Missing schema privileges must not block read-only lookups
+            logger.error(f"Failed to ensure Neo4j indexes: {e}")
+        _indexes_ready = True
+
+_known_drugs = None  # lower-cased name -> canonical Drug name
+_known_drugs_loaded_at = 0.0
+_known_drugs_lock = threading.Lock()
+
+def _get_known_drugs():
+    """
+    Return the in-memory index of Drug names, reloading it every NEO4J_DRUG_NAMES_TTL seconds.
+
+    Returns None if the index has never loaded, in which case callers should query the graph.
+    """
+    global _known_drugs, _known_drugs_loaded_at
+    if _known_drugs is not None and time.monotonic() - _known_drugs_loaded_at < settings.NEO4J_DRUG_NAMES_TTL:
+        return _known_drugs
+    with _known_drugs_lock:
+        if _known_drugs is not None and time.monotonic() - _known_drugs_loaded_at < settings.NEO4J_DRUG_NAMES_TTL:
+            return _known_drugs
+        try:
+            with _get_driver().session(database=settings.NEO4J_DATABASE) as session:
+                names = session.execute_read(lambda tx: [record["name"] for record in tx.run(_GET_ALL_DRUG_NAMES_CYPHER)])
+            _known_drugs = {name.lower(): name for name in names if name}
+            logger.info("Loaded {} Drug names into memory", len(_known_drugs))
+        except Exception as e:
+            # Keep serving the stale index (if any) until the next refresh
+            logger.error(f"Failed to load Drug names: {e}")
+        _known_drugs_loaded_at = time.monotonic()
+    return _known_drugs
+
+def close_driver():
+    """
+    Close the shared Neo4j driver and its pooled connections.
+
+    Both the driver and the read pool are recreated on next use, so the app lifespan can start again.
+    """
+    global _driver, _read_executor
+    with _driver_lock:
+        if _read_executor is not None:
+            _read_executor.shutdown(wait=False)
+            _read_executor = None
+        if _driver is not None:
+            _driver.close()
+            _driver = None
+
+atexit.register(close_driver)
+
+
+class DrugExtractionBatcher:
+    """
+    Coalesces concurrent text-only drug extraction requests into a single LLM call.
+
+    A request that finds the queue empty is dispatched straight away through the regular
+    single-query extraction. When others are already waiting, requests arriving within
+    `max_wait_ms` (up to `max_batch`) are sent together as a JSON list of queries.
+
+    The queries come from different users, so one query's text can try to steer the names
+    returned for another. On both paths a query only gets back names that occur in its own text.
+    """
+
+    def __init__(self, extract_one, extract_many, max_batch: int, max_wait_ms: int, max_concurrency: int):
+        self._extract_one = extract_one
+        self._extract_many = extract_many
+        self._max_batch = max_batch
+        self._max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._dispatcher = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="drug-extractor")
+        threading.Thread(target=self._collect, name="drug-extractor-batcher", daemon=True).start()
+
+    def submit(self, query: str) -> list[str]:
+        """Queue a query and block until its extracted drug names are available."""
+        future = Future()
+        self._queue.put((query, future))
+        return future.result()
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            if self._queue.empty():
+                self._dispatcher.submit(self._dispatch, batch)
+                continue
+            deadline = time.monotonic() + self._max_wait
+            while len(batch) < self._max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._dispatcher.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch):
+        queries = [query for query, _ in batch]
+        try:
+            if len(queries) == 1:
+                results = [self._extract_one(queries[0])]
+            else:
+                results = self._extract_many(queries)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (query, future), drug_names in zip(batch, results):
+            future.set_result(_names_in_text(drug_names, query))
+
+
+def _names_in_text(drug_names, text: str) -> list[str]:
+    """Keep only the extracted names that occur in the query text they were returned for."""
+    if not isinstance(drug_names, list):
+        return []
+    text = text.lower()
+    return [name for name in drug_names if isinstance(name, str) and name.lower() in text]
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+def _get_batcher(agent) -> DrugExtractionBatcher:
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = DrugExtractionBatcher(
+                    agent.extract_from_text,
+                    agent.extract_from_texts,
+                    max_batch=settings.DRUG_EXTRACTOR_MAX_BATCH,
+                    max_wait_ms=settings.DRUG_EXTRACTOR_MAX_WAIT_MS,
+                    max_concurrency=settings.DRUG_EXTRACTOR_MAX_CONCURRENCY,
+                )
+    return _batcher
+
 
 class MedicalAgent :
     def __init__(self):
-        self.driver = GraphDatabase.driver( settings.NEO4J_URI , auth=(settings.NEO4J_USERNAME , settings.NEO4J_PASSWORD ) )
+        self.driver = _get_driver()
+        _ensure_indexes()
 
 
-    def get_drug_info(self, tx, drug_names):
-        query = """
-        MATCH (d:Drug)
-        WHERE d.name IN $drug_names
-        RETURN d.drugbank_id AS id, d.name AS name, d.description AS description,
-            d.indication AS indication, d.mechanism_of_action AS mechanism, d.toxicity AS toxicity, d.food_interactions as food_interactions
+    def read(self, work, *args):
+        """Run `work(tx, *args)` as a managed read transaction on its own session."""
+        with self.driver.session(database=settings.NEO4J_DATABASE) as session:
+            return session.execute_read(work, *args)
+
+
+    def resolve_drug_names(self, drug_names):
         """
-        return list(tx.run(query, drug_names=drug_names))
+        Map extracted drug names to canonical names of Drug nodes, dropping unknown ones.
+
+        Uses the in-memory name index when available so misses never reach Neo4j.
+        """
+        known_drugs = _get_known_drugs()
+        if known_drugs is None:
+            return self.read(self.get_existing_drugs, drug_names)
+        return {known_drugs[name.lower()] for name in drug_names if name.lower() in known_drugs}
+
+
+    def get_existing_drugs(self, tx, drug_names):
+        """
+        Resolve extracted drug names to the canonical names of Drug nodes present in the graph.
+
+        Names hallucinated by the extractor are dropped here with a single lookup instead of
+        costing one interaction query per pair. Only used when the in-memory name index is
+        unavailable: each name is tried in its common casings (as given, lower, upper, capitalized,
+        title) so the query can use the drug_name index, which toLower(d.name) would bypass.
+        """
+        names = list({
+            variant
+            for name in drug_names
+            for variant in (name, name.lower(), name.upper(), name.capitalize(), name.title())
+        })
+        return {record["name"] for record in tx.run(_GET_EXISTING_DRUGS_CYPHER, names=names)}
+
+
+    def get_drug_info(self, tx, drug_names):
+        return [record["drug"] for record in tx.run(_GET_DRUG_INFO_CYPHER, drug_names=drug_names)]
     
 
     def get_interactions(self, tx, pairs):
         results = []
         for drug1, drug2 in pairs:
             # drug_1_id, drug_2_id = name_to_drugbank_dict[drug1], name_to_drugbank_dict[drug2]
-            query = """
-            MATCH (a:Drug {name: $drug1})-[r:INTERACTS_WITH]-(b:Drug {name: $drug2})
-            RETURN a.name AS drug1, b.name AS drug2, r.description AS description
-            """
-            rec = tx.run(query, drug1=drug1, drug2=drug2).single()
+            rec = tx.run(_GET_INTERACTIONS_CYPHER, drug1=drug1, drug2=drug2).single()
             if rec:
-                results.append(dict(rec))
+                results.append(rec["interaction"])
         return results
     
 
     def get_drugInfo_userPrompt(self, drug_infos, interaction_infos):
         """
-        Build a well-organized, markdown-formatted prompt for drug information analysis.
+        Build the markdown-formatted drug data for analysis.
+
+        Only the per-request data goes here; the instructions live in DRUG_INFO_SYSTEM_PROMPT
+        so the system message stays byte-identical across requests and can be prefix-cached.
 
         Args:
             drug_infos (list): List of dictionaries containing drug information
@@ -49,18 +321,7 @@ class MedicalAgent :
             str: Formatted prompt string
         """
 
-        prompt = """# Clinical Drug Analysis Assistant
-
-    ## Instructions
-    You are a clinical assistant tasked with analyzing drug information. Please follow these steps:
-
-    1. **Summarize each drug** - Provide a clear, concise summary of each medication
-    2. **Analyze combination risks** - List and explain the risks of combining any of these drugs
-    3. **Base responses on provided data only** - Do not generate information that cannot be verified from the data below
-
-    ---
-
-    ## Drug Information Database
+        prompt = """## Drug Information Database
 
     """
 
@@ -100,28 +361,11 @@ class MedicalAgent :
 
     """
 
-        prompt += """---
-
-    ## Output Requirements
-
-    Please structure your response as follows:
-
-    ### Drug Summaries
-    Provide a concise summary for each medication listed above.
-
-    ### Combination Risk Assessment
-    Analyze and explain any risks associated with combining these medications, based solely on the interaction data provided.
-
-    ### Clinical Recommendations
-    Offer appropriate guidance for patients or clinicians based on the available information. Include food-interaction recommendations as well if appropriate
-
-    **Note:** All information should be clearly attributed to the provided data sources. Do not include speculative or unverified information."""
-
         return prompt
     
 
     def get_drugListExtractor_systemPrompt(self):
-        prompt = """You are a drug name extraction system. Extract all drug names from the provided content and return ONLY a JSON response.
+        prompt = MEDIASSIST_PREAMBLE + """You are a drug name extraction system. Extract all drug names from the provided content and return ONLY a JSON response.
 
 Extract:
 - Generic drug names (acetaminophen, ibuprofen)
@@ -152,20 +396,49 @@ json
 Confidence scale: 1.0 (certain) to 0.6 (minimum threshold).
 
 CRITICAL: Return ONLY the JSON. No explanations, no additional text, no reasoning. Just the JSON object.
+"""
+        return prompt
+
+    def get_batchDrugListExtractor_systemPrompt(self):
+        prompt = MEDIASSIST_PREAMBLE + """You are a drug name extraction system. You will receive a JSON list of user queries. Extract all drug names from EACH query independently and return ONLY a JSON response.
+
+Extract:
+- Generic drug names (acetaminophen, ibuprofen)
+- Brand names (Tylenol, Advil)
+- Prescription and OTC medications
+- Supplements with specific drug names
+
+Do NOT extract:
+- General terms (medication, pills, tablets)
+- Dosage information
+- Medical conditions
+- Non-drug substances
+
+JSON format (one list of drug names per query, in the same order as the input, empty list if a query has no drugs):
+json
+{
+    "results": [["drug1", "drug2"], [], ["drug3"]]
+}
+
+CRITICAL: Return ONLY the JSON. The "results" list MUST have exactly as many entries as there are queries. No explanations, no additional text, no reasoning. Just the JSON object.
 """
         return prompt
     
     def complete_graphrag_search(self, extracted_drug_names_list: list[str]):
-        drug_list = extracted_drug_names_list
-        if len(drug_list) == 1:
-            drug_list.append(drug_list[0])
-        pairs = list(combinations(drug_list, 2))
-        logger.info(f"Pairs: {pairs}")
         try:
-            with self.driver.session() as session:
-                drug_infos = session.read_transaction(lambda tx: self.get_drug_info(tx, drug_list))
-                interaction_infos = session.read_transaction(lambda tx: self.get_interactions(tx, pairs))
-            logger.info(f"Drug Infos: {drug_infos}")
+            drug_list = sorted(self.resolve_drug_names(extracted_drug_names_list))
+            logger.info("Drugs found in graph: {}", drug_list)
+            if not drug_list:
+                return [], []
+            pairs = list(combinations(drug_list, 2))
+            logger.debug("Pairs: {}", pairs)
+            # Drug details and interactions are independent reads: the interactions read runs on the
+            # pool while drug details are read on this thread. A single drug has no pairs to look up.
+            interaction_future = _get_read_executor().submit(self.read, self.get_interactions, pairs) if pairs else None
+            drug_infos = self.read(self.get_drug_info, drug_list)
+            interaction_infos = interaction_future.result() if interaction_future else []
+            logger.info("Fetched {} drug infos and {} interactions", len(drug_infos), len(interaction_infos))
+            logger.debug("Drug Infos: {}", drug_infos)
             return drug_infos, interaction_infos
         except Exception as e:
             logger.error(f"Error during graph search: {e}")
@@ -173,54 +446,82 @@ CRITICAL: Return ONLY the JSON. No explanations, no additional text, no reasonin
         
     def drug_extractor(self , isImage : bool , image_source : str = None , query : str = ""):
 
+        if not isImage:
+            if settings.DRUG_EXTRACTOR_BACKEND == "local":
+                return extract_drug_names(query)
+            if settings.DRUG_EXTRACTOR_BATCHING:
+                return _get_batcher(self).submit(query)
+            return self.extract_from_text(query)
+
+        logger.info("Found image as source")
+        image_uri = get_image_data_uri(image_source)
+        extract_messages = [
+            {
+                "role": "system",
+                "content": self.get_drugListExtractor_systemPrompt()
+            },
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": "Extract the drug-names from the image"},
+                    {"type": "image_url", "image_url": {"url": image_uri}}
+                ]
+            }
+        ]
+        return self._request_drug_names(extract_messages)
+
+    def extract_from_text(self, query: str) -> list[str]:
         extract_messages = [
-        {
-            "role": "system",
-            "content": self.get_drugListExtractor_systemPrompt()
-        }
+            {"role": "system", "content": self.get_drugListExtractor_systemPrompt()},
+            {"role": "user", "content": [{"type": "text", "text": query}]},
         ]
+        return self._request_drug_names(extract_messages)
 
-        if(isImage):
-            logger.info(f"Found image as source")
-            image_base64 = encode_image(image_source)
-            extract_messages += [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": "Extract the drug-names from the image"},
-                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_base64}"}}
-                    ]
-                }
-            ]
-        else : 
-             extract_messages += [
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": query}
-                        ]
-                    }
-                ]
-             
+    def extract_from_texts(self, queries: list[str]) -> list[list[str]]:
+        """
+        Extract drug names for several queries with a single LLM call.
+
+        Falls back to concurrent single-query calls if the batched answer can't be matched back
+        to the queries.
+        """
+        extract_messages = [
+            {"role": "system", "content": self.get_batchDrugListExtractor_systemPrompt()},
+            {"role": "user", "content": [{"type": "text", "text": json.dumps(queries)}]},
+        ]
+        extract_response = get_sambanova_response(extract_messages, model = settings.DRUG_EXTRACTOR_MODEL_NAME )
+        logger.debug("Batch Extract Response: {}", extract_response)
+        try:
+            results = json.loads(extract_response[extract_response.find("{"): extract_response.rfind("}")+1])["results"]
+        except (ValueError, KeyError) as e:
+            logger.error(f"Unparseable batch extraction response: {e}")
+            results = None
+        if not isinstance(results, list) or len(results) != len(queries):
+            logger.info("Batch extraction mismatch, falling back to {} single extractions", len(queries))
+            with ThreadPoolExecutor(max_workers=len(queries), thread_name_prefix="drug-extractor-fallback") as pool:
+                return list(pool.map(self.extract_from_text, queries))
+        return results
+
+    def _request_drug_names(self, extract_messages) -> list[str]:
         extract_response = get_sambanova_response(extract_messages, model = settings.DRUG_EXTRACTOR_MODEL_NAME )
-        logger.info(f"Extract Response: {extract_response}")
+        logger.debug("Extract Response: {}", extract_response)
         extracted_drug_names = json.loads(extract_response[extract_response.find("{"): extract_response.rfind("}")+1])["drug_names"]
         return extracted_drug_names
     
     
     def get_responder_output(self, isImage : bool , image_source : str = None , query : str = ""):
         extracted_drug_names_list = self.drug_extractor(isImage, image_source, query)
-        logger.info(f"Extracted drug names: {extracted_drug_names_list}")
+        logger.info("Extracted drug names: {}", extracted_drug_names_list)
         drug_infos, interaction_infos = self.complete_graphrag_search(extracted_drug_names_list)
         user_prompt = self.get_drugInfo_userPrompt(drug_infos, interaction_infos)
-        logger.info(f"Drug Info User Prompt: {user_prompt}")
+        logger.debug("Drug Info User Prompt: {}", user_prompt)
         messages=[
-            {"role": "system", "content": "You are a helpful clinical assistant."},
+            {"role": "system", "content": DRUG_INFO_SYSTEM_PROMPT},
             {"role": "user", "content": user_prompt}
         ]
 
         response = get_sambanova_response(messages, model = settings.DRUG_INFO_MODEL_NAME)
-        logger.info(f"Drug Responder Output: {response}")
+        logger.info("Drug Responder Output: {} chars", len(response))
+        logger.debug("Drug Responder Output: {}", response)
         return response
     
 # medical_agent = MedicalAgent()
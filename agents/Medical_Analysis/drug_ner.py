@@ -0,0 +1,68 @@
+"""
+Local drug-name extraction with a biomedical NER model running on OpenVINO.
+
+Used by MedicalAgent for text queries when DRUG_EXTRACTOR_BACKEND is "local", replacing
+the LLM round-trip with in-process inference. Needs the optional `optimum[openvino]`
+and `transformers` packages, which are only imported when the model is first loaded.
+
+When DRUG_NER_OV_MODEL_PATH points at a model already exported and statically quantized
+to int8 (e.g. saved by optimum's OVQuantizer together with its tokenizer), it is loaded
+as-is. Otherwise DRUG_NER_MODEL_NAME is exported on every start, which also needs torch,
+and gets weight-only int8 compression: weights are stored in int8 but activations stay
+in floating point.
+"""
+import threading
+from core.config import settings
+from utils.logger import logger
+
+
+# Entity groups of the NER model that denote drugs
+MEDICATION_LABELS = {"Medication"}
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+def _get_pipeline():
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                from optimum.intel.openvino import OVModelForTokenClassification
+                from transformers import AutoTokenizer, pipeline
+
+                if settings.DRUG_NER_OV_MODEL_PATH:
+                    model_path = settings.DRUG_NER_OV_MODEL_PATH
+                    logger.info(f"Loading pre-exported drug NER model from {model_path}")
+                    model = OVModelForTokenClassification.from_pretrained(model_path)
+                else:
+                    model_path = settings.DRUG_NER_MODEL_NAME
+                    logger.info(f"Exporting drug NER model {model_path} with int8 weight compression")
+                    model = OVModelForTokenClassification.from_pretrained(
+                        model_path, export=True, load_in_8bit=True
+                    )
+                tokenizer = AutoTokenizer.from_pretrained(model_path)
+                _pipeline = pipeline(
+                    "token-classification", model=model, tokenizer=tokenizer, aggregation_strategy="simple"
+                )
+    return _pipeline
+
+def extract_drug_names(text: str) -> list[str]:
+    """
+    Extract drug names from free text.
+
+    Args:
+        text: The user query
+
+    Returns:
+        Unique drug names in order of appearance
+    """
+    drug_names = []
+    seen = set()
+    for entity in _get_pipeline()(text):
+        if entity["entity_group"] not in MEDICATION_LABELS:
+            continue
+        name = entity["word"].strip()
+        if name and name.lower() not in seen:
+            seen.add(name.lower())
+            drug_names.append(name)
+    return drug_names
@@ -1,16 +1,10 @@
 
-from typing import Annotated, TypedDict
+from agents.Utils.common_methods import astream_sambanova_response, build_cached_system_message, get_chatHistory_from_state
+from core.prompts import MEDIASSIST_PREAMBLE
 
-from agents.Drug_Analysis.chatbot import get_sambanova_response
-from agents.Utils.common_methods import get_chatHistory_from_state
 
-
-class ResponsderAgent:
-    def __init__(self , chat_history):
-        self.chat_history = get_chatHistory_from_state(chat_history)
-
-    def get_responder_systemPrompt(self,user_query , intent, final_response: str = ""):
-        prompt = f"""# Medical Responder Agent Prompt for Meta-Llama-3.3-70B-Instruct
+# Static instructions, identical on every request so the provider can cache them
+_RESPONDER_STATIC_SYSTEM: str = MEDIASSIST_PREAMBLE + """# Medical Responder Agent Prompt for Meta-Llama-3.3-70B-Instruct
 
 ## Core Identity & Purpose
 You are a compassionate Medical Response Agent designed to communicate complex medical information with empathy, clarity, and scientific accuracy. Your primary role is to interpret responses from specialized agents and chat history, then present information to users in an accessible, supportive manner that maintains both scientific rigor and human warmth.
@@ -25,17 +19,7 @@ You will receive three key inputs:
 3. **FINAL_RESPONSE**: The specialized agent's response (empty for small_talk intent)
 4. **USER_QUERY** : The Query which you are responding to .
 
-## CHAT_HISTORY
-{self.chat_history}
-
-## INTENT 
-{intent}
-
-## FINAL_RESPONSE
-{final_response}
-
-## USER_QUERY
-{user_query}
+These inputs are provided after these instructions.
 
 ## Core Behavioral Guidelines
 
@@ -292,11 +276,55 @@ Before finalizing each medical response, ensure:
 - Pay attention to emotional cues in CHAT_HISTORY and adjust empathy levels
 - Ensure balance between thoroughness and accessibility
 - Adapt communication style to individual user needs and conversation history"""
-        
-        return prompt
+
+# Per-request inputs, appended after the static instructions
+_RESPONDER_CONTEXT_TEMPLATE: str = """## CHAT_HISTORY
+{chat_history}
+
+## INTENT 
+{intent}
+
+## FINAL_RESPONSE
+{final_response}
+
+## USER_QUERY
+{user_query}"""
+
+
+class ResponsderAgent:
+    def __init__(self , chat_history):
+        self.chat_history = get_chatHistory_from_state(chat_history)
+
+    def get_responder_context(self,user_query , intent, final_response: str = ""):
+        return _RESPONDER_CONTEXT_TEMPLATE.format_map({
+            "chat_history": self.chat_history,
+            "intent": intent,
+            "final_response": final_response,
+            "user_query": user_query,
+        })
     
 
-    def get_responder_output(self, user_query ,intent  , final_response: str = "" ) -> str:
+    def get_responder_messages(self, user_query, intent, final_response: str = "") -> list[dict]:
+        messages = []
+        context = self.get_responder_context(user_query=user_query , intent=intent,final_response=final_response)
+        messages.append(build_cached_system_message(_RESPONDER_STATIC_SYSTEM, context))
+        
+        user_input = f"[USER] : {user_query}"
+        messages.append({"role": "user", "content": user_input})
+        return messages
+
+    async def stream_responder_output(self, user_query ,intent  , final_response: str = "" ):
+        """
+        Stream the response for the Responder Agent as the LLM generates it.
+
+        Yields:
+            str: Response content deltas.
+        """
+        messages = self.get_responder_messages(user_query, intent, final_response)
+        async for delta in astream_sambanova_response(messages, temperature=0.3, top_p=1.0, max_tokens=1000):
+            yield delta
+
+    async def get_responder_output(self, user_query ,intent  , final_response: str = "" ) -> str:
         """
         Generate the response for the Responder Agent based on the chat history.
         
@@ -306,19 +334,4 @@ Before finalizing each medical response, ensure:
         Returns:
             str: The generated response.
         """
-        messages = []
-        system_prompt = self.get_responder_systemPrompt(user_query=user_query , intent=intent,final_response=final_response)
-        messages.append({"role": "system", "content": system_prompt})
-        
-        # Simulating the response generation process
-        user_input = f"[USER] : {user_query}"
-        messages.append({"role": "user", "content": user_input})
-        
-        # Here you would typically call an API or model to get the response
-        # For now, we will just return a placeholder response
-        responder_response = get_sambanova_response(messages)
-        
-        
-        return responder_response
-        
-    
\ No newline at end of file
+        return "".join([delta async for delta in self.stream_responder_output(user_query, intent, final_response)])
@@ -1,13 +1,67 @@
-import base64
-import json
+import io
+import mmap
+import os
+import orjson
+import pybase64
 import re
-from openai import OpenAI
-import requests
-from langchain_core.messages import HumanMessage
+import threading
+import time
+from collections import OrderedDict
+import httpx
+from openai import NOT_GIVEN, AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+from PIL import ExifTags, Image, ImageOps, UnidentifiedImageError
+from langchain_core.messages import AIMessage, HumanMessage
 
-from core.config import get_settings
-settings = get_settings()
-def get_sambanova_response(messages, model="Meta-Llama-3.3-70B-Instruct", temperature=0.1, top_p=0.1):
+from agents.Utils import response_cache
+from core.config import settings
+from utils.logger import logger
+
+# Anthropic-compatible endpoints honour `cache_control` blocks once the beta header is sent
+PROMPT_CACHING_ENABLED = "anthropic" in settings.OPENAI_API_BASE.lower()
+PROMPT_CACHING_HEADERS = {"anthropic-beta": "prompt-caching-2024-07-31"}
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_llm_client() -> OpenAI:
+    """
+    Return the shared OpenAI-compatible client, creating it on first use.
+
+    Reusing one client keeps its HTTP/2 connection pool (and TLS sessions) alive across calls.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI(
+                    api_key=settings.OPENAI_API_KEY,
+                    base_url=settings.OPENAI_API_BASE,
+                    http_client=DefaultHttpxClient(
+                        http2=True,
+                        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+                    ),
+                )
+    return _client
+
+_async_client = None
+
+def get_async_llm_client() -> AsyncOpenAI:
+    """Return the shared async OpenAI-compatible client, creating it on first use."""
+    global _async_client
+    if _async_client is None:
+        with _client_lock:
+            if _async_client is None:
+                _async_client = AsyncOpenAI(
+                    api_key=settings.OPENAI_API_KEY,
+                    base_url=settings.OPENAI_API_BASE,
+                    http_client=DefaultAsyncHttpxClient(
+                        http2=True,
+                        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+                    ),
+                )
+    return _async_client
+
+def get_sambanova_response(messages, model="Meta-Llama-3.3-70B-Instruct", temperature=0.1, top_p=0.1, max_tokens=NOT_GIVEN):
     """
     Get response from SambaNova API
     
@@ -16,108 +70,321 @@ def get_sambanova_response(messages, model="Meta-Llama-3.3-70B-Instruct", temper
         model: Model name to use
         temperature: Sampling temperature
         top_p: Top-p sampling parameter
+        max_tokens: Optional cap on the number of generated tokens; omitted from the request when not given
     
     Returns:
         Response content as string
     """
-    client = OpenAI(
-        api_key=settings.OPENAI_API_KEY,
-        base_url=settings.OPENAI_API_BASE,
+    cached = response_cache.lookup(messages, temperature, model=model, top_p=top_p, max_tokens=max_tokens)
+    if cached is not None and cached.response is not None:
+        return cached.response
+
+    response = get_llm_client().chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        top_p=top_p,
+        max_tokens=max_tokens,
+        extra_headers=PROMPT_CACHING_HEADERS if PROMPT_CACHING_ENABLED else None,
     )
     
-    response = client.chat.completions.create(
+    content = response.choices[0].message.content
+    if cached is not None and content is not None:
+        cached.store(content)
+    return content
+
+async def aget_sambanova_response(messages, model="Meta-Llama-3.3-70B-Instruct", temperature=0.1, top_p=0.1, max_tokens=NOT_GIVEN):
+    """
+    Async variant of `get_sambanova_response`; awaits the API call instead of blocking the event loop.
+
+    Takes the same arguments and shares the same response cache.
+    """
+    cached = response_cache.lookup(messages, temperature, model=model, top_p=top_p, max_tokens=max_tokens)
+    if cached is not None and cached.response is not None:
+        return cached.response
+
+    response = await get_async_llm_client().chat.completions.create(
         model=model,
         messages=messages,
         temperature=temperature,
-        top_p=top_p
+        top_p=top_p,
+        max_tokens=max_tokens,
+        extra_headers=PROMPT_CACHING_HEADERS if PROMPT_CACHING_ENABLED else None,
     )
-    
-    return response.choices[0].message.content
+
+    content = response.choices[0].message.content
+    if cached is not None and content is not None:
+        cached.store(content)
+    return content
+
+async def astream_sambanova_response(messages, model="Meta-Llama-3.3-70B-Instruct", temperature=0.1, top_p=0.1, max_tokens=NOT_GIVEN):
+    """
+    Stream a response from SambaNova API as it is generated.
+
+    Takes the same arguments as `get_sambanova_response`. A cached response is yielded as a single chunk.
+
+    Yields:
+        Content deltas as strings
+    """
+    cached = response_cache.lookup(messages, temperature, model=model, top_p=top_p, max_tokens=max_tokens)
+    if cached is not None and cached.response is not None:
+        yield cached.response
+        return
+
+    stream = await get_async_llm_client().chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        top_p=top_p,
+        max_tokens=max_tokens,
+        extra_headers=PROMPT_CACHING_HEADERS if PROMPT_CACHING_ENABLED else None,
+        stream=True,
+    )
+
+    parts = []
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            delta = chunk.choices[0].delta.content
+            parts.append(delta)
+            yield delta
+
+    if cached is not None:
+        cached.store("".join(parts))
+
+def build_cached_system_message(static_prompt: str, dynamic_context: str) -> dict:
+    """
+    Build a system message whose static part can be served from the provider's prompt cache.
+
+    On Anthropic-compatible endpoints the static prompt is sent as its own `cache_control`
+    block; elsewhere the two parts are joined into a plain string with the static part first,
+    so prefix caching still applies.
+    """
+    if PROMPT_CACHING_ENABLED:
+        content = [
+            {"type": "text", "text": static_prompt, "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": dynamic_context},
+        ]
+    else:
+        content = f"{static_prompt}\n\n{dynamic_context}"
+    return {"role": "system", "content": content}
 
 def append_message_to_list(messages, role, content):
     messages.append({"role":role, "content": content})
 
-def encode_image_from_path(image_path: str) -> str:
-    """Encode image from local file path to base64 string"""
+# Longest side (in pixels) an image is downscaled to before being sent to the LLM
+MAX_IMAGE_SIDE = 1024
 
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+_image_http = None
 
-def encode_image_from_url(image_url: str) -> str:
-    """Download and encode image from URL to base64 string"""
-    # Download the image
-    response = requests.get(image_url, timeout=30)
-    response.raise_for_status()  # Raise an exception for bad status codes
+def get_image_http_client() -> httpx.Client:
+    """Return the shared keep-alive client used to download images, creating it on first use."""
+    global _image_http
+    if _image_http is None:
+        with _client_lock:
+            if _image_http is None:
+                _image_http = httpx.Client(
+                    http2=True,
+                    timeout=30,
+                    follow_redirects=True,
+                    limits=httpx.Limits(max_keepalive_connections=16),
+                )
+    return _image_http
 
-    # Encode to base64
-    image_base64 = base64.b64encode(response.content).decode('utf-8')
-    return image_base64
+# Larger downloads are refused instead of being buffered in memory
+MAX_IMAGE_DOWNLOAD_BYTES = 20 * 1024 * 1024
 
-def encode_image(image_source: str) -> str:
+def read_image_from_url(image_url: str) -> bytes:
     """
-    Universal function to encode image from either local path or URL
+    Download raw image bytes from URL
 
-    Args:
-        image_source: Either a local file path or HTTP/HTTPS URL
+    Raises:
+        ValueError: If the image is larger than MAX_IMAGE_DOWNLOAD_BYTES
+    """
+    with get_image_http_client().stream("GET", image_url) as response:
+        response.raise_for_status()  # Raise an exception for bad status codes
+        content_length = response.headers.get("Content-Length")
+        if content_length and content_length.isdigit() and int(content_length) > MAX_IMAGE_DOWNLOAD_BYTES:
+            raise ValueError(f"Image at {image_url} is larger than {MAX_IMAGE_DOWNLOAD_BYTES} bytes")
+        chunks = []
+        size = 0
+        for chunk in response.iter_bytes():
+            size += len(chunk)
+            if size > MAX_IMAGE_DOWNLOAD_BYTES:
+                raise ValueError(f"Image at {image_url} is larger than {MAX_IMAGE_DOWNLOAD_BYTES} bytes")
+            chunks.append(chunk)
+    return b"".join(chunks)
+
+# Medication-label images are often sent more than once in a session. Only the downscaled data URI is
+# kept, and only briefly, so an image replaced behind the same URL is picked up again soon.
+_URL_IMAGE_CACHE_SIZE = 32
+_URL_IMAGE_CACHE_TTL = 300  # seconds
+_url_image_cache: OrderedDict = OrderedDict()
+_url_image_cache_lock = threading.Lock()
+
+def _get_url_data_uri(image_url: str) -> str:
+    now = time.monotonic()
+    with _url_image_cache_lock:
+        cached = _url_image_cache.get(image_url)
+        if cached is not None and cached[0] > now:
+            _url_image_cache.move_to_end(image_url)
+            return cached[1]
+
+    data_uri = _to_data_uri(read_image_from_url(image_url))
+    with _url_image_cache_lock:
+        _url_image_cache[image_url] = (now + _URL_IMAGE_CACHE_TTL, data_uri)
+        _url_image_cache.move_to_end(image_url)
+        if len(_url_image_cache) > _URL_IMAGE_CACHE_SIZE:
+            _url_image_cache.popitem(last=False)
+    return data_uri
+
+# Formats passed to the vision model as-is; anything else is re-encoded to PNG
+_PASSTHROUGH_IMAGE_FORMATS = ("JPEG", "PNG", "WEBP")
+_PNG_MODES = ("1", "L", "LA", "I", "P", "RGB", "RGBA")
+
+def downscale_image(raw: bytes | mmap.mmap, max_side: int = MAX_IMAGE_SIDE) -> tuple[bytes | mmap.mmap, str]:
+    """
+    Shrink an image so its longest side is at most `max_side` pixels.
+
+    Vision models resize large inputs anyway, so sending the smaller image only
+    cuts upload size and prefill cost. The EXIF orientation is applied first so
+    phone photos are not sent rotated.
 
     Returns:
-        Base64 encoded string of the image
+        Tuple of (image bytes, MIME type). JPEG/PNG/WEBP images already upright and within bounds
+        are returned untouched. Bytes Pillow cannot identify or decode (truncated files, decompression
+        bombs) are passed through with their detected MIME type, or as PNG as before.
     """
+    try:
+        # A memory-mapped file is already seekable, so it is read in place
+        image = Image.open(raw if isinstance(raw, mmap.mmap) else io.BytesIO(raw))
+    except (UnidentifiedImageError, Image.DecompressionBombError) as e:
+        logger.warning("Could not open image ({}), forwarding the original bytes", e)
+        return raw, "image/png"
+
+    with image:
+        detected_mime = Image.MIME.get(image.format, "image/png")
+        try:
+            image_format = image.format if image.format in _PASSTHROUGH_IMAGE_FORMATS else "PNG"
+            orientation = image.getexif().get(ExifTags.Base.Orientation, 1)
+            if orientation == 1 and image_format == image.format and max(image.size) <= max_side:
+                return raw, Image.MIME[image_format]
+            upright = ImageOps.exif_transpose(image)
+            if image_format == "PNG" and upright.mode not in _PNG_MODES:
+                upright = upright.convert("RGBA")
+            upright.thumbnail((max_side, max_side))
+            buffer = io.BytesIO()
+            upright.save(buffer, format=image_format)
+        except (OSError, Image.DecompressionBombError) as e:
+            logger.warning("Could not downscale image ({}), forwarding the original bytes", e)
+            return raw, detected_mime
+    return buffer.getvalue(), Image.MIME[image_format]
+
+def _to_data_uri(raw) -> str:
+    raw, mime_type = downscale_image(raw)
+    return f"data:{mime_type};base64,{pybase64.b64encode(raw).decode('ascii')}"
+
+def get_image_data_uri(image_source: str) -> str:
+    """
+    Build a `data:` URI for an image given as a local path, HTTP/HTTPS URL or data URI
+
+    The image bytes are read once, downscaled if needed and base64-encoded in a single pass.
+    Local files are memory-mapped rather than read into a buffer. URL results are cached for a few
+    minutes. Data URIs are passed through as-is.
+    """
+    if image_source.startswith('data:image'):
+        return image_source
     if image_source.startswith(('http://', 'https://')):
-        return encode_image_from_url(image_source)
-    elif image_source.startswith('data:image'):
-        return image_source.split(',')[1]
-    else:
-        return encode_image_from_path(image_source)
-    
+        return _get_url_data_uri(image_source)
+
+    with open(image_source, "rb") as image_file:
+        # An empty file cannot be mapped
+        if os.fstat(image_file.fileno()).st_size == 0:
+            return _to_data_uri(b"")
+        with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return _to_data_uri(mapped)
+
+# URLs, local or relative file paths and data URIs in a single pass; the URL extension stays optional.
+# The leftmost match wins, so a path that appears before a URL is picked over it.
+# The local branch is greedy so "/tmp/x.png.bak.png" is not cut short at the first extension.
+_IMG_RE = re.compile(
+    r'(?P<url>https?://\S+)'
+    r'|(?P<local>(?:\.{0,2}/|[A-Za-z]:\\)\S+\.(?:png|jpe?g|gif|bmp|webp))'
+    r'|(?P<data>data:image[^\s,]+,\S+)'
+)
+
 def extract_image_info(query: str) -> dict:
     result = {
         "isImage": False,
         "imageSource": None
     }
 
-    # Regex for URLs
-    url_pattern = r'https?://[^\s]+(?:\.png|\.jpg|\.jpeg|\.gif|\.bmp|\.webp)?'
-
-    # Regex for local or relative file paths
-    local_pattern = r'(?:\.{0,2}/|[A-Za-z]:\\)[^\s]+\.(png|jpg|jpeg|gif|bmp|webp)'
-
-    # Search for URL
-    url_match = re.search(url_pattern, query)
-    if url_match:
+    # A data URI can be megabytes long; recognise it from the prefix instead of scanning it
+    if query.startswith('data:image'):
         result["isImage"] = True
-        result["imageSource"] = url_match.group(0)
+        result["imageSource"] = query
         return result
 
-    # Search for local path
-    local_match = re.search(local_pattern, query)
-    if local_match:
+    match = _IMG_RE.search(query)
+    if match:
         result["isImage"] = True
-        result["imageSource"] = local_match.group(0)
-
-    if query.startswith('data:image'):
-        result["isImage"] = True
-        result["imageSource"] = query
+        result["imageSource"] = match.group(0)
 
     return result
 
+def _other_message_to_dict(message) -> dict:
+    # Subclasses of HumanMessage miss the exact-type lookup but are still user turns
+    role = 'user' if isinstance(message, HumanMessage) else 'assistant'
+    return {'role' : role , 'content' : message.content}
+
+# Exact message type -> converter, so the common cases skip the isinstance chain
+_MESSAGE_CONVERTERS = {
+    HumanMessage: lambda message: {'role' : 'user' , 'content' : message.content},
+    AIMessage: lambda message: {'role' : 'assistant' , 'content' : message.content},
+    dict: lambda message: {'role' : message['role'] , 'content' : message['content']},
+}
+
+def _message_to_dict(message) -> dict:
+    return _MESSAGE_CONVERTERS.get(type(message), _other_message_to_dict)(message)
+
+# Serialized message prefix per session: session_id -> (message count, joined JSON items, last item).
+# History only grows between turns, so each call serializes just the new messages.
+_HISTORY_CACHE_SIZE = 1024
+_history_cache: OrderedDict = OrderedDict()
+_history_cache_lock = threading.Lock()
+
+def _serialize_messages(session_id, messages) -> bytes:
+    cached = None
+    if session_id is not None:
+        with _history_cache_lock:
+            cached = _history_cache.get(session_id)
+
+    # Reuse the prefix only while it still matches the start of the history
+    if cached is not None and 0 < cached[0] <= len(messages) \
+            and orjson.dumps(_message_to_dict(messages[cached[0] - 1])) == cached[2]:
+        count, prefix, last_item = cached
+        new_items = [orjson.dumps(_message_to_dict(message)) for message in messages[count:]]
+        joined = b",".join([prefix, *new_items])
+        if new_items:
+            last_item = new_items[-1]
+    else:
+        items = [orjson.dumps(_message_to_dict(message)) for message in messages]
+        joined = b",".join(items)
+        last_item = items[-1] if items else None
+
+    if session_id is not None and messages:
+        with _history_cache_lock:
+            _history_cache[session_id] = (len(messages), joined, last_item)
+            _history_cache.move_to_end(session_id)
+            if len(_history_cache) > _HISTORY_CACHE_SIZE:
+                _history_cache.popitem(last=False)
+    return b"[" + joined + b"]"
+
+def forget_chat_history(session_id: str):
+    """Drop the cached serialized history of a session, e.g. when it starts a new conversation."""
+    with _history_cache_lock:
+        _history_cache.pop(session_id, None)
+
 def get_chatHistory_from_state(state):
-    chat_history = {}
-    for k,v in state.items():
-        if k != "image_data":
-            chat_history[k] = v
-    message_list = []
-    for message in chat_history['messages'] :
-        if (isinstance(message,HumanMessage)):
-            role = 'user'
-            content = message.content
-        elif (isinstance(message,dict)):
-            role = message['role']
-            content = message['content']
-        else:
-            role = 'assistant'
-            content = message.content
-        message_list.append({'role' : role , 'content' : content})
-    chat_history['messages'] = message_list
-    chat_history_str = json.dumps(chat_history)
-    return chat_history_str
\ No newline at end of file
+    chat_history = {k: v for k, v in state.items() if k not in ("image_data", "messages")}
+    chat_history['messages'] = orjson.Fragment(_serialize_messages(state.get('session_id'), state['messages']))
+    return orjson.dumps(chat_history).decode()
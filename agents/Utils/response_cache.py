@@ -0,0 +1,160 @@
+"""
+In-process cache for LLM responses.
+
+Two tiers are consulted in order:
+1. An exact-match LRU keyed on a hash of the full request (model, sampling params, messages).
+2. An optional semantic tier that embeds the last user message and returns a stored response
+   when a previous request with the same earlier messages had a near-identical last message.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from core.config import settings
+from utils.logger import logger
+
+
+class ExactResponseCache:
+    """Thread-safe LRU mapping request hashes to response strings."""
+
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            response = self._entries.get(key)
+            if response is not None:
+                self._entries.move_to_end(key)
+            return response
+
+    def put(self, key: str, response: str):
+        with self._lock:
+            self._entries[key] = response
+            self._entries.move_to_end(key)
+            if len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+
+class SemanticResponseCache:
+    """
+    Cosine-similarity cache over normalized sentence embeddings stored in a FAISS inner-product index.
+
+    Entries are scoped by a hash of everything except the last user message, so a hit is only
+    returned for the same model, sampling params, system prompt and history.
+    """
+
+    def __init__(self, model_name: str, threshold: float, max_entries: int):
+        import faiss
+        from sentence_transformers import SentenceTransformer
+
+        self._encoder = SentenceTransformer(model_name)
+        self._index = faiss.IndexFlatIP(self._encoder.get_sentence_embedding_dimension())
+        self._entries: list[tuple[str, str]] = []  # (scope, response), aligned with index ids
+        self._threshold = threshold
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+
+    def embed(self, text: str):
+        return self._encoder.encode([text], normalize_embeddings=True).astype("float32")
+
+    def get(self, scope: str, vector):
+        with self._lock:
+            if not self._entries:
+                return None
+            scores, ids = self._index.search(vector, min(8, len(self._entries)))
+            for score, idx in zip(scores[0], ids[0]):
+                if idx < 0 or score < self._threshold:
+                    break
+                entry_scope, response = self._entries[idx]
+                if entry_scope == scope:
+                    return response
+        return None
+
+    def put(self, scope: str, vector, response: str):
+        with self._lock:
+            if len(self._entries) >= self._max_entries:
+                # IndexFlatIP can't evict single vectors; start over once full
+                self._index.reset()
+                self._entries.clear()
+            self._index.add(vector)
+            self._entries.append((scope, response))
+
+
+_exact_cache = ExactResponseCache(settings.LLM_CACHE_SIZE)
+_semantic_cache = None
+_semantic_cache_lock = threading.Lock()
+
+def _get_semantic_cache():
+    global _semantic_cache
+    if _semantic_cache is None:
+        with _semantic_cache_lock:
+            if _semantic_cache is None:
+                _semantic_cache = SemanticResponseCache(
+                    settings.LLM_SEMANTIC_CACHE_MODEL,
+                    threshold=settings.LLM_SEMANTIC_CACHE_THRESHOLD,
+                    max_entries=settings.LLM_CACHE_SIZE,
+                )
+    return _semantic_cache
+
+def _hash(payload) -> str:
+    return hashlib.blake2b(json.dumps(payload, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+def _last_user_text(messages):
+    """Text of the last message if it is a text-only user message, else None."""
+    last = messages[-1] if messages else None
+    if not isinstance(last, dict) or last.get("role") != "user":
+        return None
+    content = last.get("content")
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list) and all(block.get("type") == "text" for block in content):
+        return "\n".join(block["text"] for block in content)
+    return None
+
+
+class CacheLookup:
+    """Result of a cache lookup; carries what is needed to store the response on a miss."""
+
+    def __init__(self, messages, params: dict):
+        self.response = None
+        self.key = _hash([params, messages])
+        self._semantic_scope = None
+        self._semantic_vector = None
+
+        self.response = _exact_cache.get(self.key)
+        if self.response is not None or not settings.LLM_SEMANTIC_CACHE:
+            return
+        text = _last_user_text(messages)
+        if text is None:
+            return
+        try:
+            semantic_cache = _get_semantic_cache()
+            self._semantic_scope = _hash([params, messages[:-1]])
+            self._semantic_vector = semantic_cache.embed(text)
+            self.response = semantic_cache.get(self._semantic_scope, self._semantic_vector)
+        except Exception as e:
+            logger.error(f"Semantic cache lookup failed: {e}")
+            self._semantic_scope = None
+        if self.response is not None:
+            logger.debug("Semantic cache hit for key={}", self.key)
+
+    def store(self, response: str):
+        _exact_cache.put(self.key, response)
+        if self._semantic_scope is not None:
+            _get_semantic_cache().put(self._semantic_scope, self._semantic_vector, response)
+
+
+def lookup(messages, temperature: float, **params):
+    """
+    Look up a cached response for an LLM request.
+
+    Returns:
+        CacheLookup, or None when the request is not cacheable (cache disabled or sampling
+        temperature above LLM_CACHE_MAX_TEMPERATURE).
+    """
+    if settings.LLM_CACHE_SIZE <= 0 or temperature > settings.LLM_CACHE_MAX_TEMPERATURE:
+        return None
+    return CacheLookup(messages, {"temperature": temperature, **params})
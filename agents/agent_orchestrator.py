@@ -1,13 +1,14 @@
 # Main agent class containing the logic of running complete flow
 
-import json
+import asyncio
+import functools
 import re
+import orjson
 from typing import Annotated, TypedDict
-from fastapi import logger
-from langchain_core.messages import HumanMessage, AIMessage , AnyMessage
+from langchain_core.messages import AIMessage , AnyMessage
 from langgraph.graph.message import add_messages
-from langgraph.graph import StateGraph, END
-from pydantic import BaseModel
+from langgraph.config import get_stream_writer
+from langgraph.graph import StateGraph
 from utils.logger import logger
 from agents.Drug_Analysis.main import MedicalChatbot
 from agents.Intent_Analysis.intent_analysis import IntentIdentifier
@@ -21,59 +22,83 @@ class AgentState(TypedDict):
     agent_intent : str = "NOne"
     intent_response: str = "None"
     image_data: str = "None"
+    session_id: str
 # Agents Method 
 
+# Flat JSON object emitted by the intent agent, matched without DOTALL backtracking over the whole reply
+_INTENT_JSON_RE = re.compile(rb'\{[^{}]*\}')
 
-def intentAgent(state: AgentState):
+
+async def intentAgent(state: AgentState):
     # logger.info(f"IntentAgent Initial state {state}")
     last_msg = state['messages'][-1].content
     logger.info(f"Last message for the Intent agent: {last_msg}")
     agentIntent = IntentIdentifier(state.get("messages", ""))
-    intent_response = agentIntent.get_intent_agent_response(last_msg)[1]
+    intent_response = (await agentIntent.get_intent_agent_response(last_msg))[1]
     logger.info(f"Intent agent Response : {intent_response}")
-    pattern = r'\{.*?\}'
-    match = re.search(pattern,intent_response, re.DOTALL)
+    match = _INTENT_JSON_RE.search(intent_response.encode())
     if match:
-        json_str = match.group()
-        intent_result = json.loads(json_str)
+        intent_result = orjson.loads(match.group())
+    else:
+        # No JSON object in the reply, so treat it as small talk and pass the text straight through
+        logger.warning("Intent agent response contained no JSON object, defaulting to small_talk")
+        intent_result = {"actual_tag": "small_talk", "response": intent_response}
     logger.info(f"Final result of intent {intent_result}")
     intent = intent_result['actual_tag']
     response = intent_result['response']
-    return {**state , "agent_intent" : intent, "intent_response": response}
+    return {"agent_intent" : intent, "intent_response": response}
     
     
-def disease_agent(state: AgentState):
+async def disease_agent(state: AgentState):
     query = state['messages'][-1].content
-    diseaseAgent = MedicalChatbot(chat_history=state.get("messages", ""))
-    disease_response = diseaseAgent.process_user_message(query)[0]
+
+    # MedicalChatbot is synchronous (index loading + LLM calls), so keep it off the event loop
+    def run_disease_agent():
+        diseaseAgent = MedicalChatbot(chat_history=state.get("messages", ""))
+        return diseaseAgent.process_user_message(query)[0]
+
+    disease_response = await asyncio.to_thread(run_disease_agent)
     logger.info(f"Disease Analysis Agent Response {disease_response}")
     # state["messages"] = AIMessage(content=disease_response)
-    return {**state, "finalResponse": disease_response}
+    return {"finalResponse": disease_response}
 
 
-def drugs_agent(state: AgentState):
+async def drugs_agent(state: AgentState):
     query = state['messages'][-1].content
     image_data = state.get("image_data", "")
     image_info = extract_image_info(image_data)
-    drugsAgent = MedicalAgent()
-    drugs_response = drugsAgent.get_responder_output(isImage=image_info.get("isImage"), image_source=image_info.get("imageSource"), query=query)
+
+    # MedicalAgent is synchronous (Neo4j driver + LLM calls), so keep it off the event loop
+    def run_drugs_agent():
+        drugsAgent = MedicalAgent()
+        return drugsAgent.get_responder_output(isImage=image_info.get("isImage"), image_source=image_info.get("imageSource"), query=query)
+
+    drugs_response = await asyncio.to_thread(run_drugs_agent)
     # state["messages"] = AIMessage(content=drugs_response)
-    return {**state, "finalResponse": drugs_response}
+    return {"finalResponse": drugs_response}
 
-def responder_agent(state: AgentState):
+async def responder_agent(state: AgentState):
     query = state['messages'][-1].content
     intent = state['agent_intent']
     finalResponse = state.get('finalResponse', state.get('intent_response', "No response generated by the agent."))
     responder_agent = ResponsderAgent(chat_history=state)
-    responder_agent_response = responder_agent.get_responder_output(user_query=query, intent=intent , final_response=finalResponse)
+    # Tokens are forwarded as they arrive when the graph is streamed with stream_mode="custom"
+    writer = get_stream_writer()
+    parts = []
+    async for delta in responder_agent.stream_responder_output(user_query=query, intent=intent , final_response=finalResponse):
+        writer(delta)
+        parts.append(delta)
+    responder_agent_response = "".join(parts)
     logger.info(f"Following is the response of responder agent {responder_agent_response}")
-    state["messages"].append({"role" : "assistant" , "content" : responder_agent_response})
-    return {**state , "finalResponse" : responder_agent_response}
+    # Nodes return only the keys they change; add_messages appends the reply to the history
+    return {"messages" : [AIMessage(content=responder_agent_response)], "finalResponse" : responder_agent_response}
 
 def intent_condition(state : AgentState):
     return state["agent_intent"]
 
+@functools.lru_cache(maxsize=1)
 def graph_compilation():
+    """Build and compile the agent graph once; the compiled graph is stateless and safe to share across requests."""
     graph = StateGraph(AgentState)
     graph.add_node("intent", intentAgent)
     graph.add_node("disease_agent", disease_agent)
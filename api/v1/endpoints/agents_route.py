@@ -1,8 +1,10 @@
 from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 
 from models.api_models import AgentRequest, AgentResponse
-from services.agent_service import run_agent_logic
+from services.agent_service import run_agent_logic, stream_agent_logic
 from utils.logger import logger
+from utils.orjson_response import ORJSONResponse
 
 router = APIRouter()
 
@@ -17,8 +19,15 @@ async def run_agent(request: AgentRequest):
         if response.status_code >= 400:
             raise HTTPException(status_code=response.status_code, detail=response.error)
 
-        return response
+        # Returning the response class directly skips FastAPI's model -> dict pass
+        return ORJSONResponse(response)
 
     except Exception as e:
         logger.exception("Unhandled exception in /run endpoint")
-        raise
\ No newline at end of file
+        raise
+
+@router.post("/run/stream")
+async def run_agent_stream(request: AgentRequest):
+    """Same as /run, but streams the response as server-sent events while it is generated."""
+    logger.info(f"Received streaming agent request with session_id={request.session_id}")
+    return StreamingResponse(stream_agent_logic(request), media_type="text/event-stream")
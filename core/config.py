@@ -1,31 +1,64 @@
 from pydantic import Field
-from functools import lru_cache
-from pydantic_settings import BaseSettings
+from functools import cached_property, lru_cache
+from urllib.parse import quote
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
     APP_NAME: str = "MediAssist"
     DEBUG: bool = Field(default=False)
     API_VERSION: str = "v1"
+    LOG_ENQUEUE: bool = Field(default=False)  # route logs through a multiprocess-safe queue; only needed with several workers sharing a sink
 
     REDIS_HOST: str = Field(default="localhost")
     REDIS_PORT: int = Field(default=6379)
     REDIS_DB: int = Field(default=0)
     REDIS_PASSWORD: str | None = None
     REDIS_CACHE_TTL: int = Field(default=3600)  # 1 hour default cache TTL
+    REDIS_POOL_SIZE: int = Field(default=32)  # max pooled connections, shared by concurrent requests
+    REDIS_POOL_TIMEOUT: int = Field(default=10)  # seconds a command waits for a free pooled connection before failing
+    REDIS_HEALTH_CHECK_INTERVAL: int = Field(default=30)  # seconds a connection may idle before it is pinged on checkout
 
     OPENAI_API_KEY: str = Field(..., env="OPENAI_API_KEY")
     OPENAI_API_BASE: str = Field(default="https://api.openai.com/v1")
+    LLM_CACHE_SIZE: int = Field(default=2048)  # max cached LLM responses, 0 disables the cache
+    LLM_CACHE_MAX_TEMPERATURE: float = Field(default=0.1)  # calls sampling hotter than this are never cached
+    LLM_SEMANTIC_CACHE: bool = Field(default=False)  # also serve near-duplicate last user messages from cache
+    LLM_SEMANTIC_CACHE_MODEL: str = Field(default="sentence-transformers/all-MiniLM-L6-v2")
+    LLM_SEMANTIC_CACHE_THRESHOLD: float = Field(default=0.95)
 
     NEO4J_URI: str
     NEO4J_USERNAME: str
     NEO4J_PASSWORD: str
+    NEO4J_DATABASE: str = Field(default="neo4j")
+    NEO4J_DRUG_NAMES_TTL: int = Field(default=3600)  # refresh interval of the in-memory Drug name index
+    NEO4J_MAX_POOL_SIZE: int = Field(default=50)
+    NEO4J_ACQUISITION_TIMEOUT: int = Field(default=30)  # seconds to wait for a pooled connection
+    NEO4J_READ_WORKERS: int = Field(default=32)  # threads running interaction reads alongside the calling thread; keep below NEO4J_MAX_POOL_SIZE
     DRUG_EXTRACTOR_MODEL_NAME: str = Field(default="Llama-4-Maverick-17B-128E-Instruct", env="DRUG_EXTRACTOR_MODEL_NAME")
     DRUG_INFO_MODEL_NAME: str = Field(default="Meta-Llama-3.3-70B-Instruct", env="DRUG_INFO_MODEL_NAME")
+    DRUG_EXTRACTOR_BACKEND: str = Field(default="llm")  # "llm" or "local" (OpenVINO NER model, text queries only)
+    DRUG_NER_MODEL_NAME: str = Field(default="d4data/biomedical-ner-all")  # exported at startup with weight-only int8 compression
+    DRUG_NER_OV_MODEL_PATH: str | None = None  # directory of a pre-exported, statically int8-quantized model (OVQuantizer output); skips the export
+    # Coalesce concurrent text extractions into one LLM call. This sends several users' queries in a single
+    # provider request, and one query can try to steer the results of the others; names are only returned
+    # to a query whose own text contains them (single and batched calls alike), so misspelled names the
+    # model corrects are dropped. MAX_CONCURRENCY bounds how many extraction calls are in flight at once.
+    DRUG_EXTRACTOR_BATCHING: bool = Field(default=False)
+    DRUG_EXTRACTOR_MAX_BATCH: int = Field(default=8)
+    DRUG_EXTRACTOR_MAX_WAIT_MS: int = Field(default=40)
+    DRUG_EXTRACTOR_MAX_CONCURRENCY: int = Field(default=32)
 
-    class Config:
-        env_file = ".env"
-        case_sensitive = True
+    # Frozen: settings are read-only after startup, so the instance can be shared as a module constant
+    model_config = SettingsConfigDict(env_file=".env", frozen=True, case_sensitive=True)
 
-@lru_cache()
+    @cached_property
+    def redis_url(self) -> str:
+        """Connection URL for Redis, built once. The password is percent-encoded so any character is safe."""
+        auth = f":{quote(self.REDIS_PASSWORD, safe='')}@" if self.REDIS_PASSWORD else ""
+        return f"redis://{auth}{self.REDIS_HOST}:{self.REDIS_PORT}/{self.REDIS_DB}"
+
+@lru_cache(maxsize=1)
 def get_settings() -> Settings:
     return Settings()
+
+settings = get_settings()
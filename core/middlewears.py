@@ -1,16 +1,33 @@
-import uuid
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
+import os
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from utils.logger import request_id_ctx_var
 
-class RequestIDMiddleware(BaseHTTPMiddleware):
+class RequestIDMiddleware:
     """
     Middleware to generate and attach a unique request ID per request.
     The ID is stored in a context variable and used in all logs.
+
+    Written as plain ASGI rather than BaseHTTPMiddleware, which routes every request
+    through an extra pair of memory streams and buffers streaming responses.
     """
-    async def dispatch(self, request: Request, call_next):
-        request_id = str(uuid.uuid4())  # or use shorter: uuid.uuid4().hex[:8]
-        request_id_ctx_var.set(request_id)
-        response = await call_next(request)
-        response.headers["X-Request-ID"] = request_id  # Optional: send back to client
-        return response
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = os.urandom(8).hex()  # 16 hex chars, cheaper than formatting a uuid4
+        token = request_id_ctx_var.set(request_id)
+
+        async def send_with_request_id(message: Message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append("X-Request-ID", request_id)  # Optional: send back to client
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_ctx_var.reset(token)
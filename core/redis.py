@@ -1,30 +1,53 @@
-import json
+import asyncio
+import os
+import socket
+import orjson
 from typing import Union
 from fastapi import Request
 from redis import RedisError
-from redis.asyncio import Redis
+from redis.exceptions import NoScriptError
+from redis.asyncio import BlockingConnectionPool, Redis
 from utils.logger import logger
-from core.config import get_settings
+from core.config import settings
 
-settings = get_settings()
+_STATE_PREFIX = "state:"
+_SESSION_COUNTER_KEY = "session:counter"
+
+# Returns the value at KEYS[1], first storing ARGV[2] with TTL ARGV[1] if the key is missing
+_GET_OR_INIT_LUA = """
+local v = redis.call('GET', KEYS[1])
+if not v then
+    redis.call('SETEX', KEYS[1], ARGV[1], ARGV[2])
+    return ARGV[2]
+end
+return v
+"""
+
+# Probe idle connections after 60s, every 10s, dropping them after 3 misses.
+# Only options the platform defines are set (macOS has no TCP_KEEPIDLE, for instance).
+_KEEPALIVE_OPTIONS = {
+    getattr(socket, name): value
+    for name, value in (("TCP_KEEPIDLE", 60), ("TCP_KEEPINTVL", 10), ("TCP_KEEPCNT", 3))
+    if hasattr(socket, name)
+}
+
+# Background writer: flush queued writes every WRITE_FLUSH_INTERVAL seconds, at most WRITE_BATCH_SIZE per pipeline
+WRITE_FLUSH_INTERVAL = 0.005
+WRITE_BATCH_SIZE = 100
 
 class RedisCache:
     """
-    A singleton class for interacting with Redis using aioredis.
+    A class for interacting with Redis using aioredis.
+
+    The application shares the single module-level `redis_cache` instance.
 
     Provides methods to get/set values, manage TTLs, and handle JSON serialization,
     with built-in logging and error handling.
     """
-    _instance = None
     _client: Union[Redis,None] = None
-
-    def __new__(cls):
-        """Ensure only one instance of RedisCache exists (Singleton pattern)."""
-        if cls._instance is None:
-            cls._instance = super(RedisCache, cls).__new__(cls)
-        return cls._instance
-    
-    
+    _write_queue: Union[asyncio.Queue,None] = None
+    _writer_task: Union[asyncio.Task,None] = None
+    _get_or_init_sha: Union[str,None] = None
 
     async def init(self):
         """
@@ -33,19 +56,28 @@ class RedisCache:
         Should be called once at app startup before using Redis operations.
         """
         if self._client is None:
-            redis_url = (
-                f"redis://:{settings.REDIS_PASSWORD}@" if settings.REDIS_PASSWORD else "redis://"
-            ) + f"{settings.REDIS_HOST}:{settings.REDIS_PORT}/{settings.REDIS_DB}"
-
             try:
-                self._client = await Redis.from_url(
-                    redis_url,
+                # Concurrent requests each check out their own connection instead of queueing on one socket.
+                # The pool blocks when exhausted, so load spikes wait for a connection instead of failing.
+                pool = BlockingConnectionPool.from_url(
+                    settings.redis_url,
+                    max_connections=settings.REDIS_POOL_SIZE,
+                    timeout=settings.REDIS_POOL_TIMEOUT,
                     encoding="utf-8",
-                    decode_responses=True,
+                    # Values stay bytes: orjson parses them directly and callers decode only if they need text
+                    decode_responses=False,
+                    socket_keepalive=True,
+                    socket_keepalive_options=_KEEPALIVE_OPTIONS,
+                    health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
                 )
+                # from_pool hands the pool to the client, so close() also disconnects it
+                self._client = Redis.from_pool(pool)
                 pong = await self._client.ping()
                 logger.info(f"Redis connection established: {pong}")
                 logger.info("Redis client initialized in RedisCache.")
+                self._get_or_init_sha = await self._client.script_load(_GET_OR_INIT_LUA)
+                self._write_queue = asyncio.Queue()
+                self._writer_task = asyncio.create_task(self._write_loop())
             except RedisError as e:
                 logger.error(f"Failed to initialize Redis: {e}")
                 raise RuntimeError("Redis initialization failed") from e
@@ -59,30 +91,93 @@ class RedisCache:
             RuntimeError: if Redis client hasn't been initialized.
         """
         if self._client is None:
-            raise RuntimeError("Redis client not initialized. Call `await RedisCache().init()` first.")
+            raise RuntimeError("Redis client not initialized. Call `await redis_cache.init()` first.")
         return self._client
     
-    def get_stateKey(self , session_id: str) -> str:
-        return f"state:{session_id}"
+    @staticmethod
+    def get_stateKey(session_id: str) -> str:
+        return _STATE_PREFIX + session_id
+
+    async def new_session_id(self) -> str:
+        """
+        Mint a session ID from an atomic Redis counter plus a random suffix.
+
+        The session ID is the only thing guarding a session's stored history, so it must not be
+        guessable: the counter keeps IDs unique, the 64-bit random suffix keeps them secret
+        (and keeps them distinct if the counter restarts after a flush).
+
+        Returns:
+            str: "s", the counter in hex, then 16 random hex chars; only the random part if Redis is unavailable.
+        """
+        try:
+            n = await self._client.incr(_SESSION_COUNTER_KEY)
+            return f"s{n:x}{os.urandom(8).hex()}"
+        except RedisError as e:
+            logger.error(f"Redis INCR error for key {_SESSION_COUNTER_KEY}: {e}")
+            return os.urandom(8).hex()
 
     async def get(self, key: str) :
         """
-        Get the raw string value for a given Redis key.
+        Get the raw value for a given Redis key.
 
         Args:
             key (str): The Redis key.
 
         Returns:
-            str | None: The string value or None if not found or error occurred.
+            bytes | None: The stored bytes or None if not found or error occurred.
         """
         try:
             value = await self._client.get(key)
-            logger.debug(f"GET Redis key={key} found={value is not None}")
+            logger.debug("GET Redis key={} found={}", key, value is not None)
             return value
         except RedisError as e:
             logger.error(f"Redis GET error for key {key}: {e}")
             return None
 
+    async def get_many(self, keys: list[str]) -> list:
+        """
+        Get the raw values of several keys concurrently.
+
+        Each GET is issued at once on its own pooled connection, so the total wait is about
+        one round-trip rather than one per key. Use `mget_json` for a single pipelined call.
+
+        Args:
+            keys (list[str]): The Redis keys.
+
+        Returns:
+            list: Values in key order, None where not found or an error occurred.
+        """
+        return list(await asyncio.gather(*(self.get(key) for key in keys)))
+
+    async def get_or_init_state(self, session_id: str, ttl: int, default_json: str | bytes) :
+        """
+        Atomically fetch a session's state, creating it with `default_json` if absent.
+
+        Runs server-side as a preloaded Lua script, so the lookup and the initial write
+        cost a single round-trip.
+
+        Args:
+            session_id (str): The session whose state to fetch.
+            ttl (int): Time to live in seconds for a newly created state.
+            default_json (str | bytes): JSON stored and returned when no state exists yet.
+
+        Returns:
+            bytes | None: The stored (or newly initialized) state JSON, or None if an error occurred.
+        """
+        key = self.get_stateKey(session_id)
+        try:
+            try:
+                value = await self._client.evalsha(self._get_or_init_sha, 1, key, ttl, default_json)
+            except NoScriptError:
+                # The script cache was flushed (e.g. Redis restarted); load it again and retry once
+                self._get_or_init_sha = await self._client.script_load(_GET_OR_INIT_LUA)
+                value = await self._client.evalsha(self._get_or_init_sha, 1, key, ttl, default_json)
+            logger.debug("GET-OR-INIT Redis key={}", key)
+            return value
+        except RedisError as e:
+            logger.error(f"Redis GET-OR-INIT error for key {key}: {e}")
+            return None
+
     async def set(self, key: str, value: str) -> bool:
         """
         Set a key with a string value (no expiry).
@@ -96,7 +191,7 @@ class RedisCache:
         """
         try:
             await self._client.set(key, value)
-            logger.debug(f"SET Redis key={key}")
+            logger.debug("SET Redis key={}", key)
             return True
         except RedisError as e:
             logger.error(f"Redis SET error for key {key}: {e}")
@@ -116,7 +211,7 @@ class RedisCache:
         """
         try:
             await self._client.setex(key, ttl, value)
-            logger.debug(f"SETEX Redis key={key} ttl={ttl}")
+            logger.debug("SETEX Redis key={} ttl={}", key, ttl)
             return True
         except RedisError as e:
             logger.error(f"Redis SETEX error for key {key}: {e}")
@@ -134,7 +229,7 @@ class RedisCache:
         """
         try:
             await self._client.delete(key)
-            logger.debug(f"DEL Redis key={key}")
+            logger.debug("DEL Redis key={}", key)
             return True
         except RedisError as e:
             logger.error(f"Redis DEL error for key {key}: {e}")
@@ -152,7 +247,7 @@ class RedisCache:
         """
         try:
             result = await self._client.exists(key)
-            logger.debug(f"EXISTS Redis key={key} exists={result}")
+            logger.debug("EXISTS Redis key={} exists={}", key, result)
             return result == 1
         except RedisError as e:
             logger.error(f"Redis EXISTS error for key {key}: {e}")
@@ -171,25 +266,41 @@ class RedisCache:
         raw = await self.get(key)
         if raw:
             try:
-                return json.loads(raw)
-            except json.JSONDecodeError as e:
+                return orjson.loads(raw)
+            except orjson.JSONDecodeError as e:
                 logger.error(f"Redis JSON decode error for key {key}: {e}")
         return None
 
-    async def set_json(self, key: str, value: dict, ttl: int = None) -> bool:
+    async def get_raw_json_bytes(self, key: str) -> bytes | None:
+        """
+        Get the stored JSON for a key as bytes, without decoding it.
+
+        For callers that pass the document straight through (e.g. as an HTTP response body).
+
+        Args:
+            key (str): The Redis key.
+
+        Returns:
+            bytes | None: The raw JSON or None if not found or error occurred.
+        """
+        return await self.get(key)
+
+    async def set_json(self, key: str, value: dict | str | bytes, ttl: int = None) -> bool:
         """
         Store a JSON-encoded dictionary in Redis.
 
         Args:
             key (str): The Redis key.
-            value (dict): Dictionary to store.
+            value (dict | str | bytes): Dictionary to store, or an already-serialized JSON document
+                which is stored as-is.
             ttl (int, optional): Time to live in seconds.
 
         Returns:
             bool: Success status.
         """
         try:
-            json_value = json.dumps(value)
+            # orjson emits bytes, which redis-py writes as-is
+            json_value = value if isinstance(value, (str, bytes)) else orjson.dumps(value)
             if ttl:
                 return await self.setex(key, ttl, json_value)
             else:
@@ -198,10 +309,118 @@ class RedisCache:
             logger.error(f"Redis JSON set error for key {key}: {e}")
             return False
 
+    async def mget_json(self, keys: list[str]) -> list:
+        """
+        Get several JSON-decoded objects in a single round-trip.
+
+        Args:
+            keys (list[str]): The Redis keys.
+
+        Returns:
+            list: Decoded dictionaries in key order; None for missing or undecodable keys,
+            or for every key if the pipeline failed.
+        """
+        try:
+            async with self._client.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.get(key)
+                raw_values = await pipe.execute()
+            logger.debug("MGET (pipelined) Redis keys={}", len(keys))
+        except RedisError as e:
+            logger.error(f"Redis pipelined GET error for {len(keys)} keys: {e}")
+            return [None] * len(keys)
+
+        values = []
+        for key, raw in zip(keys, raw_values):
+            value = None
+            if raw:
+                try:
+                    value = orjson.loads(raw)
+                except orjson.JSONDecodeError as e:
+                    logger.error(f"Redis JSON decode error for key {key}: {e}")
+            values.append(value)
+        return values
+
+    async def mset_json(self, items: dict[str, dict], ttl: int = None) -> bool:
+        """
+        Store several JSON-encoded dictionaries in a single round-trip.
+
+        Args:
+            items (dict[str, dict]): Mapping of Redis key to dictionary to store.
+            ttl (int, optional): Time to live in seconds, applied to every key.
+
+        Returns:
+            bool: Success status.
+        """
+        try:
+            async with self._client.pipeline(transaction=False) as pipe:
+                for key, value in items.items():
+                    if ttl:
+                        pipe.setex(key, ttl, orjson.dumps(value))
+                    else:
+                        pipe.set(key, orjson.dumps(value))
+                await pipe.execute()
+            logger.debug("MSET (pipelined) Redis keys={} ttl={}", len(items), ttl)
+            return True
+        except (RedisError, TypeError) as e:
+            logger.error(f"Redis pipelined JSON set error for {len(items)} keys: {e}")
+            return False
+
+    async def set_json_async(self, key: str, value: dict, ttl: int = None) -> None:
+        """
+        Queue a JSON-encoded dictionary for a background pipelined write and return immediately.
+
+        Use for writes the caller does not need acknowledged; failures are only logged.
+        Falls back to a blocking `set_json` if the writer has not been started.
+
+        Args:
+            key (str): The Redis key.
+            value (dict): Dictionary to store.
+            ttl (int, optional): Time to live in seconds.
+        """
+        if self._write_queue is None:
+            await self.set_json(key, value, ttl)
+            return
+        self._write_queue.put_nowait((key, orjson.dumps(value), ttl))
+
+    async def _write_loop(self):
+        """Drain the write queue in small batches, one non-transactional pipeline per batch."""
+        while True:
+            batch = [await self._write_queue.get()]
+            # Give concurrent requests a moment to queue their writes into the same pipeline
+            await asyncio.sleep(WRITE_FLUSH_INTERVAL)
+            while len(batch) < WRITE_BATCH_SIZE and not self._write_queue.empty():
+                batch.append(self._write_queue.get_nowait())
+            try:
+                async with self._client.pipeline(transaction=False) as pipe:
+                    for key, value, ttl in batch:
+                        if ttl:
+                            pipe.setex(key, ttl, value)
+                        else:
+                            pipe.set(key, value)
+                    await pipe.execute()
+                logger.debug("Flushed {} queued Redis writes", len(batch))
+            except RedisError as e:
+                logger.error(f"Redis queued write error for {len(batch)} keys: {e}")
+            finally:
+                for _ in batch:
+                    self._write_queue.task_done()
+
     async def close(self):
+        if self._writer_task:
+            # Flush what is already queued before dropping the connection
+            try:
+                await asyncio.wait_for(self._write_queue.join(), timeout=5)
+            except asyncio.TimeoutError:
+                logger.warning(f"Dropping {self._write_queue.qsize()} queued Redis writes on shutdown")
+            self._writer_task.cancel()
+            self._writer_task = None
+            self._write_queue = None
         try:
             if self._client:
                 logger.info("Closing Redis client connection.")
                 await self._client.close()
         except RedisError as e:
-            logger.error(f"Redis close error: {e}")
\ No newline at end of file
+            logger.error(f"Redis close error: {e}")
+
+redis_cache = RedisCache()
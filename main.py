@@ -1,26 +1,29 @@
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from core.config import get_settings
+from core.config import settings
 from core.middlewears import RequestIDMiddleware
-from core.redis import RedisCache
+from core.redis import redis_cache
+from agents.Medical_Analysis.Medical_rag import close_driver
 from utils.logger import logger
+from utils.orjson_response import ORJSONResponse
 from api.v1.endpoints.agents_route import router as agents_router
 
-settings = get_settings()
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    logger.info("🚀 Starting up application...")
+    # uvicorn picks uvloop automatically when it is installed (pinned via --loop in the Dockerfile)
+    logger.info(f"🚀 Starting up application on {type(asyncio.get_running_loop()).__name__}...")
     try:
-        await RedisCache().init()
+        await redis_cache.init()
         logger.info("✅ RedisCache initialized.")
     except Exception as e:
         logger.error(f"❌ Redis init failed: {e}")
         raise
 
     yield  # Application runs here
-    await RedisCache().close()
+    await redis_cache.close()
+    close_driver()
     logger.info("🛑 Shutting down application...")
 
 app = FastAPI(
@@ -28,6 +31,7 @@ app = FastAPI(
     version=settings.API_VERSION,
     debug=settings.DEBUG,
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     docs_url="/docs",  # Swagger UI
     redoc_url="/redoc",  # ReDoc UI
 )
@@ -1,3 +1,4 @@
+import orjson
 from pydantic import BaseModel
 
 class AgentRequest(BaseModel):
@@ -11,4 +12,14 @@ class AgentResponse(BaseModel):
     response: str
     session_id: str
     error: str | None = None
-    status_code: int = 200  # Default to 200 OK
\ No newline at end of file
+    status_code: int = 200  # Default to 200 OK
+
+    def to_json_bytes(self) -> bytes:
+        """Serialize with a fixed field template, skipping pydantic's generic serializer. Keep in sync with the fields above."""
+        return (
+            b'{"response":' + orjson.dumps(self.response)
+            + b',"session_id":' + orjson.dumps(self.session_id)
+            + b',"error":' + orjson.dumps(self.error)
+            + b',"status_code":' + str(self.status_code).encode()
+            + b'}'
+        )
\ No newline at end of file
@@ -1,62 +1,70 @@
 import json
-import uuid
-from agents.Utils.common_methods import get_chatHistory_from_state
+import orjson
+from agents.Utils.common_methods import forget_chat_history, get_chatHistory_from_state
 from agents.agent_orchestrator import graph_compilation
-from core.redis import RedisCache
+from core.config import settings
+from core.redis import RedisCache, redis_cache
 from models.api_models import AgentRequest, AgentResponse
 
 from utils.logger import logger
 
+_EMPTY_STATE_JSON = orjson.dumps({
+    "messages": [],
+    "intent": None,
+    "final_response": None
+})
+
+async def load_state(redis: RedisCache, payload: AgentRequest, session_id: str) -> dict:
+    """Fetch the session state from Redis (or start a new one) and add the incoming query to it."""
+    # One round-trip fetches the history, or creates an empty one for a new session
+    chat_history = await redis.get_or_init_state(session_id, settings.REDIS_CACHE_TTL, _EMPTY_STATE_JSON)
+    if chat_history is None:
+        # The lookup failed; starting over here would overwrite the stored history on save
+        raise RuntimeError(f"Could not load state for session_id={session_id}")
+    logger.debug(f"Fetched chat history for session_id={session_id}")
+    state = orjson.loads(chat_history)
+    if not state["messages"]:
+        # Fresh (or expired and re-created) state: a prefix cached under this ID belongs to an older conversation
+        forget_chat_history(session_id)
+
+    # Lets the chat-history serializer reuse what it already encoded for this session
+    state["session_id"] = session_id
+    state["messages"].append({
+        "role": "user",
+        "content": payload.query
+    })
+
+    if payload.img_base64:
+        state["image_data"] = payload.img_base64
+        logger.debug(f"Image data added to state for session_id={session_id}")
+
+    return state
+
+async def save_state(redis: RedisCache, session_id: str, final_state: dict):
+    chat_history = get_chatHistory_from_state(final_state)
+    # Save updated state back to Redis, refreshing the same TTL the state was created with
+    await redis.setex(redis.get_stateKey(session_id), settings.REDIS_CACHE_TTL, chat_history)
+
 async def run_agent_logic(payload: AgentRequest) -> AgentResponse:
     logger.debug(f"Running agent with query='{payload.query}', session_id='{payload.session_id}'")
-    redis = RedisCache()
+    redis = redis_cache
     
     try:
-        session_id = payload.session_id or str(uuid.uuid4())
+        session_id = payload.session_id or await redis.new_session_id()
         print(f"Session Id is {session_id}")
 
-        # TODO: fetch history from cache if required based on session_id
-        stateKey = redis.get_stateKey(session_id)
-        chat_history = ""
-        if await redis.exists(stateKey):
-            logger.debug(f"Fetching chat history for session_id={session_id}")
-            chat_history = await redis.get(stateKey)
-            state = json.loads(chat_history)
-        else:
-            state = {
-                "messages": [],
-                "intent": None,
-                "final_response": None
-             }
-
-        state["messages"].append({
-            "role": "user",
-            "content": payload.query
-        })
-
-        if payload.img_base64:
-            state["image_data"] = payload.img_base64
-            logger.debug(f"Image data added to state for session_id={session_id}")
-
-        # print(f"This is the state passed {state}")  
+        state = await load_state(redis, payload, session_id)
 
         app_graph = graph_compilation()
-        # TODO: call the agent and process the query
 
-        for updated_state in app_graph.stream(state):
-            pass
-       
-        # print(f"This is the updated state {updated_state}")
+        final_state = await app_graph.ainvoke(state)
 
-
-        result = updated_state['responder_agent']['finalResponse']
+        result = final_state['finalResponse']
         if not result:
             result = "No response generated by the agent."
         logger.info(f"Agent response for session_id={session_id}: {result}")
 
-        chat_history = get_chatHistory_from_state(updated_state['responder_agent'])
-        # Save updated state back to Redis
-        await redis.set(stateKey, chat_history)  # Set TTL to 1 hour
+        await save_state(redis, session_id, final_state)
 
         return AgentResponse(
             response=result,
@@ -72,3 +80,42 @@ async def run_agent_logic(payload: AgentRequest) -> AgentResponse:
             error=str(e),
             status_code=500,
         )
+
+def sse_event(data: dict, event: str | None = None) -> str:
+    """Format a server-sent event."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+async def stream_agent_logic(payload: AgentRequest):
+    """
+    Run the agent and stream the responder's answer as server-sent events.
+
+    Yields a `{"token": ...}` event per generated chunk, then an `end` event carrying the
+    full response and session_id, or an `error` event if processing fails.
+    """
+    logger.debug(f"Streaming agent with query='{payload.query}', session_id='{payload.session_id}'")
+    redis = redis_cache
+
+    try:
+        session_id = payload.session_id or await redis.new_session_id()
+        state = await load_state(redis, payload, session_id)
+
+        app_graph = graph_compilation()
+
+        final_state = None
+        async for mode, chunk in app_graph.astream(state, stream_mode=["custom", "values"]):
+            if mode == "custom":
+                yield sse_event({"token": chunk})
+            else:
+                final_state = chunk
+
+        result = final_state['finalResponse'] or "No response generated by the agent."
+        logger.info(f"Agent response for session_id={session_id}: {result}")
+
+        await save_state(redis, session_id, final_state)
+
+        yield sse_event({"response": result, "session_id": session_id}, event="end")
+
+    except Exception as e:
+        logger.exception("Agent streaming failed")
+        yield sse_event({"error": str(e), "session_id": payload.session_id or "unknown"}, event="error")
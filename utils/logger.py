@@ -2,7 +2,7 @@ from loguru import logger
 import sys
 import contextvars
 
-from core.config import get_settings
+from core.config import settings
 
 request_id_ctx_var: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
 
@@ -11,8 +11,6 @@ def request_id_filter(record):
     record["extra"]["request_id"] = request_id_ctx_var.get("-")
     return True
 
-settings = get_settings()
-
 logger.remove()  # Remove default handler
 logger.add(
     sys.stderr,
@@ -23,7 +21,7 @@ logger.add(
            "REQ_ID=<yellow>{extra[request_id]}</yellow> - "
            "<level>{message}</level>",
     filter=request_id_filter,
-    enqueue=True,
+    enqueue=settings.LOG_ENQUEUE,
     backtrace=True,
     diagnose=settings.DEBUG,
 )
@@ -0,0 +1,24 @@
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from models.api_models import AgentResponse
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSONResponse that renders with orjson.
+
+    orjson returns UTF-8 bytes directly, skipping the str -> bytes re-encode of the stdlib encoder.
+    Pydantic models are serialized straight to JSON bytes by pydantic-core, without a dict in between.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, AgentResponse):
+            return content.to_json_bytes()
+        if isinstance(content, BaseModel):
+            return content.__pydantic_serializer__.to_json(content)
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)